@@ -0,0 +1,80 @@
+"""
+Persistent embedding cache
+Stores chunk embeddings in SQLite keyed by content hash and model name
+"""
+
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "repo_analyzer" / "embeddings.db"
+
+# Stay well below SQLite's host parameter limit
+_QUERY_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """SQLite-backed cache of embedding vectors keyed by (content hash of the text, model)."""
+
+    def __init__(self, model_name: str, path: Path = DEFAULT_CACHE_PATH):
+        """
+        Open (creating if needed) the cache database.
+
+        Args:
+            model_name: Identifier of the embedding model; vectors are only
+                reused for the same model
+            path: Location of the SQLite database file
+        """
+        self.model_name = model_name
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS emb ("
+                "hash BLOB, model TEXT, vec BLOB, PRIMARY KEY (hash, model))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def get_many(self, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Look up cached vectors.
+
+        Args:
+            hashes: Content hashes to look up
+
+        Returns:
+            Mapping of hash to float32 vector for every cache hit
+        """
+        found = {}
+        with closing(self._connect()) as conn:
+            for start in range(0, len(hashes), _QUERY_BATCH_SIZE):
+                batch = hashes[start:start + _QUERY_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT hash, vec FROM emb WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model_name, *batch]
+                )
+                for digest, vec in rows:
+                    found[digest] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, np.ndarray]]) -> None:
+        """
+        Store vectors in a single transaction.
+
+        Args:
+            items: (hash, vector) pairs
+        """
+        rows = [
+            (digest, self.model_name, np.asarray(vec, dtype=np.float32).tobytes())
+            for digest, vec in items
+        ]
+        if not rows:
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO emb (hash, model, vec) VALUES (?, ?, ?)", rows)
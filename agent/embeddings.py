@@ -0,0 +1,166 @@
+"""
+Embedding backends for the RAG pipeline
+Runs MiniLM as an INT8-quantized ONNX model instead of PyTorch FP32
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Exported/quantized ONNX models are written here once and reused
+ONNX_CACHE_DIR = Path.home() / ".cache" / "repo_analyzer" / "onnx"
+
+# A cached export is only used once both of these are present
+MODEL_FILE = "model_optimized_quantized.onnx"
+TOKENIZER_FILE = "tokenizer_config.json"
+
+
+class OptimumEmbeddings(Embeddings):
+    """Sentence embeddings from an optimized, INT8-quantized ONNX Runtime model."""
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 batch_size: int = 64, max_length: int = 256):
+        """
+        Load (exporting and quantizing on first use) the ONNX encoder.
+
+        Args:
+            model_name: HuggingFace model id of a sentence-transformers model
+            batch_size: Number of texts per forward pass
+            max_length: Maximum tokens per text
+        """
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        model_dir = ONNX_CACHE_DIR / model_name.replace("/", "__")
+        quantized_dir = model_dir / "quantized"
+        if not self._is_exported(quantized_dir):
+            self._export(model_name, model_dir)
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(quantized_dir, file_name=MODEL_FILE)
+        self.tokenizer = AutoTokenizer.from_pretrained(quantized_dir)
+
+    @staticmethod
+    def _is_exported(quantized_dir: Path) -> bool:
+        return (quantized_dir / MODEL_FILE).exists() and (quantized_dir / TOKENIZER_FILE).exists()
+
+    @classmethod
+    def _export(cls, model_name: str, model_dir: Path) -> None:
+        """
+        Export the model to ONNX, apply graph optimizations and dynamic INT8 quantization.
+
+        Everything is written to a private temporary directory and moved into
+        place in one rename, so a crash or a concurrent export never leaves a
+        half-written cache behind.
+        """
+        model_dir.mkdir(parents=True, exist_ok=True)
+        quantized_dir = model_dir / "quantized"
+        work_dir = Path(tempfile.mkdtemp(prefix=".export-", dir=model_dir))
+        try:
+            cls._export_to(model_name, work_dir)
+            if quantized_dir.exists() and not cls._is_exported(quantized_dir):
+                # Left incomplete by an interrupted export
+                shutil.rmtree(quantized_dir, ignore_errors=True)
+            try:
+                os.replace(work_dir / "quantized", quantized_dir)
+            except OSError:
+                # Another session finished first; keep its copy
+                if not cls._is_exported(quantized_dir):
+                    raise
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    @staticmethod
+    def _export_to(model_name: str, work_dir: Path) -> None:
+        """Write the optimized and quantized models under work_dir."""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+        from transformers import AutoTokenizer
+
+        optimized_dir = work_dir / "optimized"
+        quantized_dir = work_dir / "quantized"
+
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+        optimizer = ORTOptimizer.from_pretrained(model)
+        optimizer.optimize(
+            save_dir=optimized_dir,
+            optimization_config=OptimizationConfig(optimization_level=99)
+        )
+
+        quantizer = ORTQuantizer.from_pretrained(optimized_dir, file_name="model_optimized.onnx")
+        quantizer.quantize(
+            save_dir=quantized_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        )
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(quantized_dir)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode one batch: mean-pool token embeddings and L2-normalize."""
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        outputs = self.model(**inputs)
+        token_embeddings = np.asarray(outputs.last_hidden_state, dtype=np.float32)
+
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents."""
+        vectors = [
+            self._encode(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if not vectors:
+            return []
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self._encode([text])[0].tolist()
+
+
+def create_embeddings(model_name: str) -> Embeddings:
+    """
+    Create the embedding backend for a sentence-transformers model.
+
+    Uses the quantized ONNX model when optimum is installed and the model
+    exports and loads; otherwise falls back to the PyTorch HuggingFaceEmbeddings.
+
+    Args:
+        model_name: Model name, with or without the sentence-transformers/ prefix
+
+    Returns:
+        LangChain embeddings instance
+    """
+    if "/" not in model_name:
+        model_name = f"sentence-transformers/{model_name}"
+
+    try:
+        return OptimumEmbeddings(model_name)
+    except ImportError:
+        pass
+    except Exception as e:
+        # A failed export or a broken cache should cost speed, not RAG
+        print(f"ONNX embeddings unavailable, using PyTorch: {e}")
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
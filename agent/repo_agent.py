@@ -3,9 +3,10 @@ Repository Analysis Agent
 Orchestrates RAG queries and diagram generation decisions
 """
 
+import asyncio
 import json
 import re
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, List, Any, Optional, Tuple
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 
@@ -20,6 +21,9 @@ from .prompts import (
     DOCUMENTATION_PROMPT
 )
 
+# Opening of a ```json fenced block, positioned at the object's first brace
+_JSON_FENCE_RE = re.compile(r'```json\s*(?=\{)')
+
 
 class RepoAnalysisAgent:
     """Agent for analyzing repositories and generating architecture diagrams."""
@@ -37,50 +41,98 @@ class RepoAnalysisAgent:
             google_api_key=google_api_key,
             temperature=0.3
         )
-        self.rag = RAGPipeline()
+        # Created on ingest, or supplied already indexed
+        self.rag: Optional[RAGPipeline] = None
         self.repo_data = None
         self.overview = None
         self.diagram_plan = None
+        # RAG results reused across analysis stages; reset on ingest
+        self._file_structure = None
+        self._architecture_context: Dict[int, str] = {}
     
     def _parse_json_response(self, response: str) -> Optional[Dict]:
         """Extract JSON from LLM response."""
-        try:
-            # Try to find JSON in code blocks
-            match = re.search(r'```json\s*(\{.*?\})\s*```', response, re.DOTALL)
-            if match:
-                return json.loads(match.group(1))
-            
-            # Try to find raw JSON
-            match = re.search(r'\{.*\}', response, re.DOTALL)
-            if match:
-                return json.loads(match.group(0))
-            
-            return None
-        except json.JSONDecodeError:
-            return None
+        decoder = json.JSONDecoder()
+        
+        # Prefer a ```json fenced block when the model emitted one
+        match = _JSON_FENCE_RE.search(response)
+        if match:
+            try:
+                data, _ = decoder.raw_decode(response, match.end())
+                return data
+            except json.JSONDecodeError:
+                pass
+        
+        # Otherwise decode from each candidate opening brace in a single
+        # forward scan
+        start = response.find('{')
+        while start != -1:
+            try:
+                data, _ = decoder.raw_decode(response, start)
+                return data
+            except json.JSONDecodeError:
+                start = response.find('{', start + 1)
+        
+        return None
     
-    def _call_llm(self, prompt: str, system_prompt: str = None) -> str:
-        """Call the LLM with given prompts."""
+    def _build_messages(self, prompt: str, system_prompt: str = None) -> List:
+        """Build the chat messages for an LLM call."""
         messages = []
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=prompt))
-        
-        response = self.llm.invoke(messages)
+        return messages
+    
+    def _call_llm(self, prompt: str, system_prompt: str = None) -> str:
+        """Call the LLM with given prompts."""
+        response = self.llm.invoke(self._build_messages(prompt, system_prompt))
+        return response.content
+    
+    async def _call_llm_async(self, prompt: str, system_prompt: str = None) -> str:
+        """Call the LLM without blocking the event loop."""
+        response = await self.llm.ainvoke(self._build_messages(prompt, system_prompt))
         return response.content
     
-    def ingest_repository(self, repo_data: Dict[str, Any]) -> int:
+    async def _rag_query_async(self, query: str, k: int) -> List:
+        """Run a RAG query in a worker thread."""
+        return await asyncio.to_thread(self.rag.query, query, k)
+    
+    def _get_file_structure(self) -> str:
+        """Get the repository file tree, computed once per ingested repo."""
+        if self._file_structure is None:
+            self._file_structure = self.rag.get_file_structure(self.repo_data['files'])
+        return self._file_structure
+    
+    def _get_architecture_context(self, k: int) -> str:
+        """Get architecture context for k results per query, computed once per k."""
+        if k not in self._architecture_context:
+            self._architecture_context[k] = self.rag.get_architecture_context(k=k)
+        return self._architecture_context[k]
+    
+    def ingest_repository(self, repo_data: Dict[str, Any], rag: Optional[RAGPipeline] = None,
+                          files: Optional[Iterable[Tuple[str, Dict[str, Any]]]] = None) -> int:
         """
         Ingest repository data into the RAG pipeline.
         
         Args:
             repo_data: Repository data from GitHub fetcher
+            rag: Pipeline already indexed for this repository; used as-is
+                instead of rebuilding the index
+            files: Optional stream of (path, file data) pairs to index instead
+                of repo_data['files'], so indexing starts while files are
+                still being fetched
             
         Returns:
             Number of documents indexed
         """
         self.repo_data = repo_data
-        return self.rag.build_index(repo_data['files'])
+        self._file_structure = None
+        self._architecture_context = {}
+        if rag is not None:
+            self.rag = rag
+            return len(rag.docs)
+        self.rag = RAGPipeline()
+        return self.rag.build_index(repo_data['files'] if files is None else files)
     
     def analyze_overview(self) -> Dict[str, Any]:
         """
@@ -93,10 +145,10 @@ class RepoAnalysisAgent:
             raise ValueError("No repository data. Call ingest_repository first.")
         
         # Get file structure
-        file_structure = self.rag.get_file_structure(self.repo_data['files'])
+        file_structure = self._get_file_structure()
         
         # Get architecture-relevant context
-        code_context = self.rag.get_architecture_context(k=8)
+        code_context = self._get_architecture_context(k=8)
         
         # Format prompt
         prompt = REPO_OVERVIEW_PROMPT.format(
@@ -140,9 +192,13 @@ class RepoAnalysisAgent:
             "error handling exceptions"
         ]
         
+        async def run_queries():
+            return await asyncio.gather(*[
+                self._rag_query_async(query, k=3) for query in additional_queries
+            ])
+        
         additional_context_parts = []
-        for query in additional_queries:
-            results = self.rag.query(query, k=3)
+        for results in asyncio.run(run_queries()):
             for doc in results:
                 additional_context_parts.append(
                     f"[{doc.metadata.get('source', 'unknown')}]\n{doc.page_content[:500]}"
@@ -176,16 +232,8 @@ class RepoAnalysisAgent:
         
         return self.diagram_plan
     
-    def generate_diagram_data(self, diagram_spec: Dict[str, Any]) -> Optional[Dict]:
-        """
-        Generate diagram JSON data based on specification.
-        
-        Args:
-            diagram_spec: Diagram specification from plan_diagrams
-            
-        Returns:
-            Diagram JSON data ready for rendering
-        """
+    def _build_diagram_prompt(self, diagram_spec: Dict[str, Any]) -> str:
+        """Query RAG context and format the generation prompt for a diagram."""
         diagram_type = diagram_spec.get('type', 'Sequence')
         focus_area = diagram_spec.get('generation_prompt', diagram_spec.get('title', ''))
         
@@ -203,7 +251,7 @@ class RepoAnalysisAgent:
                 code_context=code_context[:10000]
             )
         elif diagram_type == "Mindmap":
-            file_structure = self.rag.get_file_structure(self.repo_data['files'])
+            file_structure = self._get_file_structure()
             components = json.dumps(self.overview.get('components', []), indent=2)
             prompt = MINDMAP_FROM_REPO_PROMPT.format(
                 repo_name=self.repo_data['full_name'],
@@ -231,7 +279,11 @@ class RepoAnalysisAgent:
                 code_context=code_context[:10000]
             )
         
-        response = self._call_llm(prompt, ANALYSIS_SYSTEM_PROMPT)
+        return prompt
+    
+    def _finalize_diagram_data(self, diagram_spec: Dict[str, Any], response: str) -> Optional[Dict]:
+        """Parse the LLM response and attach diagram metadata."""
+        diagram_type = diagram_spec.get('type', 'Sequence')
         diagram_data = self._parse_json_response(response)
         
         if diagram_data:
@@ -243,23 +295,46 @@ class RepoAnalysisAgent:
         
         return diagram_data
     
+    def generate_diagram_data(self, diagram_spec: Dict[str, Any]) -> Optional[Dict]:
+        """
+        Generate diagram JSON data based on specification.
+        
+        Args:
+            diagram_spec: Diagram specification from plan_diagrams
+            
+        Returns:
+            Diagram JSON data ready for rendering
+        """
+        prompt = self._build_diagram_prompt(diagram_spec)
+        response = self._call_llm(prompt, ANALYSIS_SYSTEM_PROMPT)
+        return self._finalize_diagram_data(diagram_spec, response)
+    
+    async def _generate_diagram_data_async(self, diagram_spec: Dict[str, Any]) -> Optional[Dict]:
+        """Async variant of generate_diagram_data."""
+        prompt = await asyncio.to_thread(self._build_diagram_prompt, diagram_spec)
+        response = await self._call_llm_async(prompt, ANALYSIS_SYSTEM_PROMPT)
+        return self._finalize_diagram_data(diagram_spec, response)
+    
     def generate_all_diagrams(self) -> List[Dict]:
         """
         Generate all planned diagrams.
         
+        The LLM calls for all diagrams run concurrently.
+        
         Returns:
             List of diagram JSON data
         """
         if not self.diagram_plan:
             self.plan_diagrams()
         
-        diagrams = []
-        for spec in self.diagram_plan.get('diagrams', []):
-            diagram_data = self.generate_diagram_data(spec)
-            if diagram_data:
-                diagrams.append(diagram_data)
+        specs = self.diagram_plan.get('diagrams', [])
+        
+        async def generate_all():
+            return await asyncio.gather(*[
+                self._generate_diagram_data_async(spec) for spec in specs
+            ])
         
-        return diagrams
+        return [diagram_data for diagram_data in asyncio.run(generate_all()) if diagram_data]
     
     def generate_documentation(self, diagrams: List[Dict]) -> str:
         """
@@ -1,12 +1,19 @@
 import streamlit as st
 import google.generativeai as genai
-import json
+import hashlib
+import orjson
 import os
-import re
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers import JsonOutputParser
+from diagram_generator import (
+    collect_json_stream, get_cached_response, inject_data_into_html, load_prompt, load_template,
+    put_cached_response, response_cache_key, serialize_for_html, strip_code_fence, validate_json
+)
 
 # Load environment variables
 load_dotenv(override=True)
@@ -15,159 +22,118 @@ load_dotenv(override=True)
 st.set_page_config(layout="wide", page_title="Ai Graph Generator", initial_sidebar_state="collapsed")
 
 def load_prompt_template():
-    try:
-        with open("json_only_prompt.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
+    content = load_prompt("json_only_prompt.txt")
+    if content is None:
         st.error("Error: json_only_prompt.txt not found.")
-        return None
+    return content
 
 def load_modification_prompt():
-    try:
-        with open("modification_prompt.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
+    content = load_prompt("modification_prompt.txt")
+    if content is None:
         st.error("Error: modification_prompt.txt not found.")
-        return None
+    return content
 
 def load_html_template():
-    try:
-        with open("template.html", "r", encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
+    content = load_template("template.html")
+    if content is None:
         st.error("Error: template.html not found.")
-        return None
+    return content
 
 def load_mindmap_prompt():
-    try:
-        with open("mindmap_prompt.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
+    return load_prompt("mindmap_prompt.txt")
 
 def load_sequence_prompt():
-    try:
-        with open("sequence_prompt.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
+    return load_prompt("sequence_prompt.txt")
 
 def load_sequence_template():
-    try:
-        with open("sequence_template.html", "r", encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
+    return load_template("sequence_template.html")
 
 def load_timeline_prompt():
-    try:
-        with open("timeline_prompt.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
+    return load_prompt("timeline_prompt.txt")
 
 def load_timeline_template():
+    return load_template("timeline_template.html")
+
+# Chat/diagram state is saved per session id so a page reload can restore it;
+# anchored to the module directory like the Gemini response cache
+SESSION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sessions")
+# Every run refreshes the file's mtime, so only sessions left alone this long are removed
+SESSION_TTL_SECONDS = 7 * 24 * 60 * 60
+_PERSISTED_KEYS = ("chat_messages", "current_json_data", "current_json_str", "html_content")
+
+def _session_path(session_id):
+    return os.path.join(SESSION_DIR, f"{session_id}.json")
+
+def _cleanup_sessions_loop():
+    while True:
+        cutoff = time.time() - SESSION_TTL_SECONDS
+        try:
+            for entry in os.scandir(SESSION_DIR):
+                if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+        except OSError:
+            pass
+        time.sleep(60)
+
+@st.cache_resource(show_spinner=False)
+def start_session_cleanup():
+    """Start the idle-session cleanup thread once per server process."""
+    thread = threading.Thread(target=_cleanup_sessions_loop, daemon=True)
+    thread.start()
+    return thread
+
+def restore_session():
+    """Return this browser's session id (adding it to the URL if new) and load its saved state."""
+    session_id = st.query_params.get("session_id")
     try:
-        with open("timeline_template.html", "r", encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
+        session_id = str(uuid.UUID(session_id))
+    except (TypeError, ValueError):
+        session_id = str(uuid.uuid4())
+        st.query_params["session_id"] = session_id
+        return session_id
 
-def validate_json(json_str):
+    # Mark the session as in use, even on runs that do not rewrite it
     try:
-        # Regex to find JSON block enclosed in ```json ... ``` or just { ... }
-        match = re.search(r'```json\s*(\{.*?\})\s*```', json_str, re.DOTALL)
-        if match:
-             json_str = match.group(1)
-        else:
-             # Fallback: Try to find the first outer {} block
-             match_fallback = re.search(r'\{.*\}', json_str, re.DOTALL)
-             if match_fallback:
-                 json_str = match_fallback.group(0)
-        
-        data = json.loads(json_str)
-        
-        # Determine schema validation type
-        if 'participants' in data and 'events' in data:
-            # Sequence Diagram Schema
-            if not isinstance(data.get('participants'), list):
-                 print("Validation Error: 'participants' must be a list")
-                 return None
-            if not isinstance(data.get('events'), list):
-                 print("Validation Error: 'events' must be a list")
-                 return None
-
-            return data
-
-        # Timeline Schema
-        if 'mermaid_syntax' in data:
-            return data
-
-        # Graph/Mindmap Schema (Fallback)
-        required_fields = ['nodes', 'hierarchy', 'edges']
-        for field in required_fields:
-            if field not in data:
-                print(f"Validation Error: Missing field '{field}'")
-                return None
-                
-        if not isinstance(data.get('nodes'), list):
-             print("Validation Error: 'nodes' must be a list")
-             return None
-
-        # Validate each node has an ID
-        for i, node in enumerate(data['nodes']):
-            if not isinstance(node, dict) or 'id' not in node:
-                print(f"Validation Error: Node at index {i} missing 'id' or not an object")
-                return None
-                
-        if not isinstance(data.get('edges'), list):
-             print("Validation Error: 'edges' must be a list")
-             return None
-
-        # Validate each edge has source/target
-        for i, edge in enumerate(data['edges']):
-            if not isinstance(edge, dict) or 'source' not in edge or 'target' not in edge:
-                print(f"Validation Error: Edge at index {i} missing source/target")
-                return None
-        
-        return data
-    except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}")
-        return None
-
-def inject_data_into_html(html_content, json_data):
-    json_str = json.dumps(json_data, indent=2)
-    # Escape </script> to prevent breaking HTML
-    json_str = json_str.replace("</", "<\\/")
-
-    start_marker = "/* [INJECTION_START] */"
-    end_marker = "/* [INJECTION_END] */"
-    
-    start_idx = html_content.find(start_marker)
-    end_idx = html_content.find(end_marker)
-    
-    if start_idx != -1 and end_idx != -1:
-        # Calculate split points
-        # Keep the content before the start marker (and the marker itself for clarity if desired, but let's replace OUT the marker to avoid clutter or keep it?)
-        # Let's keep the markers so we can verify inspection later if needed.
-        
-        pre_content = html_content[:start_idx]
-        post_content = html_content[end_idx + len(end_marker):]
-        
-        # We need to construct the new block.
-        # Note: We are replacing everything BETWEEN start_idx and end_idx + len(end_marker).
-        # Actually, let's just replace the whole block.
-        
-        new_block = f"{start_marker}\n            const architectureData = {json_str};\n            {end_marker}"
-        return pre_content + new_block + post_content
-    
-    else:
-        st.error("Could not find the insertion point in the HTML template.")
-        return html_content
+        os.utime(_session_path(session_id))
+    except OSError:
+        pass
 
-def generate_graph(topic, api_key, graph_type="Graph"):
+    # Only a fresh Streamlit session (e.g. after a reload) needs restoring
+    if 'chat_messages' not in st.session_state:
+        try:
+            with open(_session_path(session_id), "rb") as f:
+                saved = orjson.loads(f.read())
+            for key in _PERSISTED_KEYS:
+                if key in saved:
+                    st.session_state[key] = saved[key]
+        except (OSError, orjson.JSONDecodeError):
+            pass
+    return session_id
+
+def save_session(session_id):
+    """Write the persisted keys for this session atomically."""
+    state = {key: st.session_state.get(key) for key in _PERSISTED_KEYS}
+    path = _session_path(session_id)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(state))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Failed to save session {session_id}: {e}")
+
+@st.cache_resource(show_spinner=False)
+def get_genai_model(api_key):
     genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    return genai.GenerativeModel('gemini-2.5-flash')
+
+@st.cache_resource(show_spinner=False)
+def get_langchain_llm(api_key):
+    return ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key)
+
+def generate_graph(topic, api_key, graph_type="Graph"):
+    model = get_genai_model(api_key)
     
     prompt_template = None
     html_loader = load_html_template
@@ -175,48 +141,53 @@ def generate_graph(topic, api_key, graph_type="Graph"):
     if graph_type == "Mindmap":
         prompt_template = load_mindmap_prompt()
         if not prompt_template:
-            return None, None, "Mindmap prompt template (mindmap_prompt.txt) not found."
+            return None, None, None, "Mindmap prompt template (mindmap_prompt.txt) not found."
     elif graph_type == "Sequence":
         prompt_template = load_sequence_prompt()
         html_loader = load_sequence_template
         if not prompt_template:
-            return None, None, "Sequence prompt template (sequence_prompt.txt) not found."
+            return None, None, None, "Sequence prompt template (sequence_prompt.txt) not found."
     elif graph_type == "Timeline":
         prompt_template = load_timeline_prompt()
         html_loader = load_timeline_template
         if not prompt_template:
-            return None, None, "Timeline prompt template (timeline_prompt.txt) not found."
+            return None, None, None, "Timeline prompt template (timeline_prompt.txt) not found."
     else:
         prompt_template = load_prompt_template()
         
     if prompt_template:
-        final_prompt = prompt_template.replace("[INSERT TOPIC HERE]", topic)
+        final_prompt = prompt_template.format_map({"topic": topic})
+        cache_key = response_cache_key(final_prompt)
         try:
-            response = model.generate_content(final_prompt)
-            json_data = validate_json(response.text)
+            json_data = get_cached_response(cache_key)
+            if json_data is None:
+                stream = model.generate_content(final_prompt, stream=True)
+                response_text = collect_json_stream(chunk.text for chunk in stream)
+                json_data = validate_json(response_text)
+                if json_data:
+                    put_cached_response(cache_key, json_data)
             if json_data:
                 html_template = html_loader()
                 if html_template:
-                    new_html = inject_data_into_html(html_template, json_data)
-                    return new_html, json_data, None
+                    json_str = serialize_for_html(json_data)
+                    new_html = inject_data_into_html(html_template, json_str=json_str)
+                    return new_html, json_data, json_str, None
             else:
                 # Include a snippet of the raw text for debugging
-                raw_snippet = response.text[:500].replace('\n', ' ')
-                return None, None, f"Failed to generate valid JSON. Model Output start: {raw_snippet}..."
+                raw_snippet = response_text[:500].replace('\n', ' ')
+                return None, None, None, f"Failed to generate valid JSON. Model Output start: {raw_snippet}..."
         except Exception as e:
-            return None, None, f"Exception: {str(e)}"
-    return None, None, "Prompt template not found."
+            return None, None, None, f"Exception: {str(e)}"
+    return None, None, None, "Prompt template not found."
 
 def load_mindmap_modification_prompt():
-    try:
-        with open("mindmap_modification_prompt.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
+    content = load_prompt("mindmap_modification_prompt.txt")
+    if content is None:
         st.error("Error: mindmap_modification_prompt.txt not found.")
-        return None
+    return content
 
-def modify_graph(current_json, prompt, api_key, graph_type="Graph"):
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key)
+def modify_graph(current_json, prompt, api_key, graph_type="Graph", current_json_str=None):
+    llm = get_langchain_llm(api_key)
     
     template = None
     if graph_type == "Mindmap":
@@ -225,23 +196,30 @@ def modify_graph(current_json, prompt, api_key, graph_type="Graph"):
         template = load_modification_prompt()
 
     if not template:
-        return None, None, "Modification prompt file missing."
+        return None, None, None, "Modification prompt file missing."
         
-    # Replace placeholders in the text file
-    final_prompt = template.replace("[INSERT CURRENT JSON DATA HERE]", json.dumps(current_json))
-    final_prompt = final_prompt.replace("[INSERT CHANGE REQUEST HERE]", prompt)
+    if current_json_str is None:
+        current_json_str = serialize_for_html(current_json)
+
+    # Fill placeholders in the text file in a single pass
+    final_prompt = template.format_map({"current_json": current_json_str, "change_request": prompt})
     
+    cache_key = response_cache_key(final_prompt)
     try:
-        messages = [
-            HumanMessage(content=final_prompt)
-        ]
-        
-        response = llm.invoke(messages)
-        content = response.content
-        content = re.sub(r'```json\s*', '', content)
-        content = re.sub(r'```\s*$', '', content)
-        
-        new_json_data = json.loads(content)
+        new_json_data = get_cached_response(cache_key)
+        if new_json_data is None:
+            messages = [
+                HumanMessage(content=final_prompt)
+            ]
+            
+            content = collect_json_stream(chunk.content for chunk in llm.stream(messages))
+            content = strip_code_fence(content)
+            
+            new_json_data = validate_json(content)
+            if not new_json_data:
+                raw_snippet = content[:500].replace('\n', ' ')
+                return None, None, None, f"Failed to generate valid JSON. Model Output start: {raw_snippet}..."
+            put_cached_response(cache_key, new_json_data)
         
         html_loader = load_html_template
         if graph_type == "Sequence":
@@ -252,18 +230,101 @@ def modify_graph(current_json, prompt, api_key, graph_type="Graph"):
         html_template = html_loader()
         
         if html_template:
-            new_html = inject_data_into_html(html_template, new_json_data)
-            return new_html, new_json_data, None
+            new_json_str = serialize_for_html(new_json_data)
+            new_html = inject_data_into_html(html_template, json_str=new_json_str)
+            return new_html, new_json_data, new_json_str, None
             
     except Exception as e:
-        return None, None, str(e)
+        return None, None, None, str(e)
         
-    return None, None, "Unknown error during modification."
+    return None, None, None, "Unknown error during modification."
+
+def _html_hash(html_content):
+    return hashlib.blake2b(html_content.encode("utf-8"), digest_size=8).hexdigest()
+
+@st.fragment
+def chat_sidebar(api_key, session_id):
+    """Sidebar chat. Runs as a fragment so a chat turn does not re-send the graph component."""
+    st.header("AI Assistant")
+
+    if not api_key:
+        st.warning("GOOGLE_API_KEY missing in .env")
+
+    # Graph Type Selector
+    graph_type = st.radio("Structure", ["Graph", "Mindmap", "Sequence", "Timeline"], horizontal=True, help="Choose 'Graph' for hierarchical flows, 'Mindmap' for radial brainstorming, 'Sequence' for interaction diagrams, or 'Timeline' for chronological events.")
+
+    # Chat Interface
+    chat_container = st.container(height=700) 
+    with chat_container:
+        if not st.session_state.chat_messages:
+            st.info("👋 Welcome! Type a topic (e.g., 'Solar System') to generate a graph, or ask for changes.")
+        for msg in st.session_state.chat_messages:
+            with st.chat_message(msg["role"]):
+                st.markdown(msg["content"])
+
+    # Chat Input
+    if prompt := st.chat_input("Type a topic or modification..."):
+         # Add user message to state
+        st.session_state.chat_messages.append({"role": "user", "content": prompt})
+
+        # Show user message immediately
+        with chat_container:
+            with st.chat_message("user"):
+                st.markdown(prompt)
+
+        if not api_key:
+             st.session_state.chat_messages.append({"role": "assistant", "content": "Error: API Key missing."})
+        else:
+            target_json = st.session_state.current_json_data
+
+            if target_json is None:
+                # Generate New
+                with st.spinner(f"Generating '{prompt}' ({graph_type})..."):
+                    new_html, json_data, json_str, error = generate_graph(prompt, api_key, graph_type)
+                    if new_html:
+                        st.session_state.html_content = new_html
+                        st.session_state.current_json_data = json_data
+                        st.session_state.current_json_str = json_str
+                        st.session_state.chat_messages.append({"role": "assistant", "content": f"Generated graph for: {prompt}"})
+                    else:
+                        error_msg = f"Error: {error}"
+                        st.error(error_msg) # Show globally
+                        st.session_state.chat_messages.append({"role": "assistant", "content": error_msg})
+            else:
+                # Modify Existing
+                with st.spinner("Modifying..."):
+                    new_html, json_data, json_str, error = modify_graph(
+                        target_json, prompt, api_key, graph_type,
+                        current_json_str=st.session_state.current_json_str
+                    )
+                    if new_html:
+                        st.session_state.html_content = new_html
+                        st.session_state.current_json_data = json_data # Update state
+                        st.session_state.current_json_str = json_str
+                        st.session_state.chat_messages.append({"role": "assistant", "content": "Graph updated successfully!"})
+                    else:
+                        st.session_state.chat_messages.append({"role": "assistant", "content": f"Error: {error}"})
+
+        save_session(session_id)
+
+        # Only a changed graph needs the full app run (and the large HTML
+        # component payload); otherwise show the reply within this fragment
+        if _html_hash(st.session_state.html_content) != st.session_state.get("last_html_hash"):
+            st.rerun()
+        with chat_container:
+            with st.chat_message("assistant"):
+                st.markdown(st.session_state.chat_messages[-1]["content"])
 
 def main():
+    start_session_cleanup()
+    session_id = restore_session()
+
     # Initialize JSON data state to allow modifications
     if 'current_json_data' not in st.session_state:
         st.session_state.current_json_data = None
+    # Serialized form of current_json_data, reused for the next modification prompt
+    if 'current_json_str' not in st.session_state:
+        st.session_state.current_json_str = None
         
     # Initialize chat history (optional, but good for UX)
     if 'chat_messages' not in st.session_state:
@@ -310,68 +371,14 @@ def main():
 
     # --- Sidebar (Now Right Fly-out) ---
     with st.sidebar:
-        st.header("AI Assistant")
-        
-        if not api_key:
-            st.warning("GOOGLE_API_KEY missing in .env")
-            
-        # Graph Type Selector
-        graph_type = st.radio("Structure", ["Graph", "Mindmap", "Sequence", "Timeline"], horizontal=True, help="Choose 'Graph' for hierarchical flows, 'Mindmap' for radial brainstorming, 'Sequence' for interaction diagrams, or 'Timeline' for chronological events.")
-        
-        # Chat Interface
-        chat_container = st.container(height=700) 
-        with chat_container:
-            if not st.session_state.chat_messages:
-                st.info("👋 Welcome! Type a topic (e.g., 'Solar System') to generate a graph, or ask for changes.")
-            for msg in st.session_state.chat_messages:
-                with st.chat_message(msg["role"]):
-                    st.markdown(msg["content"])
-        
-        # Chat Input
-        if prompt := st.chat_input("Type a topic or modification..."):
-             # Add user message to state
-            st.session_state.chat_messages.append({"role": "user", "content": prompt})
-            
-            # Show user message immediately
-            with chat_container:
-                with st.chat_message("user"):
-                    st.markdown(prompt)
-
-            if not api_key:
-                 st.session_state.chat_messages.append({"role": "assistant", "content": "Error: API Key missing."})
-            else:
-                target_json = st.session_state.current_json_data
-                
-                if target_json is None:
-                    # Generate New
-                    with st.spinner(f"Generating '{prompt}' ({graph_type})..."):
-                        new_html, json_data, error = generate_graph(prompt, api_key, graph_type)
-                        if new_html:
-                            st.session_state.html_content = new_html
-                            st.session_state.current_json_data = json_data
-                            st.session_state.chat_messages.append({"role": "assistant", "content": f"Generated graph for: {prompt}"})
-                        else:
-                            error_msg = f"Error: {error}"
-                            st.error(error_msg) # Show globally
-                            st.session_state.chat_messages.append({"role": "assistant", "content": error_msg})
-                else:
-                    # Modify Existing
-                    with st.spinner("Modifying..."):
-                        new_html, json_data, error = modify_graph(target_json, prompt, api_key, graph_type)
-                        if new_html:
-                            st.session_state.html_content = new_html
-                            st.session_state.current_json_data = json_data # Update state
-                            st.session_state.chat_messages.append({"role": "assistant", "content": "Graph updated successfully!"})
-                        else:
-                            st.session_state.chat_messages.append({"role": "assistant", "content": f"Error: {error}"})
-            st.rerun()
+        chat_sidebar(api_key, session_id)
 
     # --- Main Area ---
     st.title("Interactive Graph Generator")
     
-    # Render Graph
     # Render Graph
     if st.session_state.html_content:
+        st.session_state.last_html_hash = _html_hash(st.session_state.html_content)
         # Increased height from 850 to 1200 for a bigger view
         st.components.v1.html(st.session_state.html_content, height=1200, scrolling=True)
         
@@ -3,30 +3,281 @@ Diagram Generator Module
 Extracted from app.py for reuse by the repo analyzer agent
 """
 
-import json
+import asyncio
+import hashlib
+import os
 import re
-from typing import Dict, Any, Optional, Tuple
+import shelve
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 import google.generativeai as genai
+import orjson
 
+try:
+    import jsonschema_rs
+except ImportError:  # Optional: validate_json falls back to the Python checks
+    jsonschema_rs = None
 
-def load_template(template_path: str) -> Optional[str]:
-    """Load an HTML template file."""
+
+# JSON extraction patterns, compiled once
+_JSON_FENCED = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_SCAN = re.compile(r'[{}"\\]')
+
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+
+# On-disk cache of validated model replies, keyed by the filled prompt
+RESPONSE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "gemini")
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+_response_cache_lock = threading.Lock()
+
+# Upper bound on concurrent Gemini requests in generate_from_topics
+MAX_CONCURRENT_REQUESTS = 8
+
+# Graph/Mindmap schema, compiled once; mirrors _validate_graph_fields
+GRAPH_SCHEMA = {
+    "type": "object",
+    "required": ["nodes", "hierarchy", "edges"],
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {"type": "object", "required": ["id"]}
+        },
+        "edges": {
+            "type": "array",
+            "items": {"type": "object", "required": ["source", "target"]}
+        }
+    }
+}
+GRAPH_SCHEMA_VALIDATOR = jsonschema_rs.validator_for(GRAPH_SCHEMA) if jsonschema_rs else None
+
+# Injection block markers in the HTML templates
+_START_MARKER = "/* [INJECTION_START] */"
+_END_MARKER = "/* [INJECTION_END] */"
+
+
+def _loads(s: str) -> Any:
+    return orjson.loads(s)
+
+
+def _dumps(o: Any, indent: bool = False) -> str:
+    return orjson.dumps(o, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+
+
+def response_cache_key(prompt: str, model_name: str = GEMINI_MODEL_NAME) -> str:
+    """Cache key for a filled prompt sent to a given model."""
+    return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def get_cached_response(key: str) -> Optional[Dict]:
+    """Return the validated JSON stored under key, or None if missing or older than the TTL."""
     try:
-        with open(template_path, "r", encoding='utf-8') as f:
+        with _response_cache_lock, shelve.open(RESPONSE_CACHE_PATH, flag="r") as cache:
+            entry = cache.get(key)
+    except Exception:
+        # Cache not created yet or unreadable
+        return None
+    if entry is None:
+        return None
+    stored_at, data = entry
+    if time.time() - stored_at > RESPONSE_CACHE_TTL:
+        return None
+    return data
+
+
+def put_cached_response(key: str, data: Dict) -> None:
+    """Store validated JSON under key."""
+    try:
+        os.makedirs(os.path.dirname(RESPONSE_CACHE_PATH), exist_ok=True)
+        with _response_cache_lock, shelve.open(RESPONSE_CACHE_PATH) as cache:
+            cache[key] = (time.time(), data)
+    except Exception as e:
+        print(f"Response cache write failed: {e}")
+
+
+@lru_cache(maxsize=None)
+def _read_template(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding='utf-8') as f:
             return f.read()
     except FileNotFoundError:
         return None
 
 
-def load_prompt(prompt_path: str) -> Optional[str]:
-    """Load a prompt template file."""
+def _to_format_template(raw: str) -> str:
+    """
+    Turn a prompt file into a str.format_map template.
+    Literal braces are escaped and the [INSERT ...] placeholders become fields.
+    """
+    return (
+        raw.replace("{", "{{").replace("}", "}}")
+        .replace("[INSERT TOPIC HERE]", "{topic}")
+        .replace("[INSERT CURRENT JSON DATA HERE]", "{current_json}")
+        .replace("[INSERT CHANGE REQUEST HERE]", "{change_request}")
+    )
+
+
+@lru_cache(maxsize=None)
+def _read_prompt(path: str) -> Optional[str]:
     try:
-        with open(prompt_path, "r") as f:
-            return f.read()
+        with open(path, "r") as f:
+            return _to_format_template(f.read())
     except FileNotFoundError:
         return None
 
 
+def load_template(template_path: str) -> Optional[str]:
+    """Load an HTML template file (read from disk once per process)."""
+    return _read_template(os.path.abspath(template_path))
+
+
+def load_prompt(prompt_path: str) -> Optional[str]:
+    """
+    Load a prompt template file (read from disk once per process).
+    Returns a str.format_map template with topic/current_json/change_request fields.
+    """
+    return _read_prompt(os.path.abspath(prompt_path))
+
+
+def _extract_json_object(s: str) -> Optional[str]:
+    """
+    Return the first balanced {...} block in s, or None.
+    Single linear scan that ignores braces inside string literals.
+    """
+    start = s.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped_pos = -1
+    for match in _JSON_SCAN.finditer(s, start):
+        i = match.start()
+        if i == escaped_pos:
+            continue
+        c = match.group()
+        if in_string:
+            if c == '\\':
+                escaped_pos = i + 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return s[start:i + 1]
+    return None
+
+
+def strip_code_fence(content: str) -> str:
+    """Remove an optional ```json / ``` fence around a model reply."""
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:].lstrip()
+    elif content.startswith("```"):
+        content = content[3:].lstrip()
+    if content.endswith("```"):
+        content = content[:-3].rstrip()
+    return content
+
+
+class _JsonStreamScanner:
+    """
+    Incremental version of _extract_json_object for streamed replies.
+    Each chunk is scanned once; brace depth, string and escape state carry over.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape_next = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk. Returns True once the first top-level object has closed."""
+        self.parts.append(chunk)
+        pos = 0
+        if not self.started:
+            pos = chunk.find('{')
+            if pos == -1:
+                return False
+            self.started = True
+        escaped_pos = pos if self.escape_next else -1
+        self.escape_next = False
+        for match in _JSON_SCAN.finditer(chunk, pos):
+            i = match.start()
+            if i == escaped_pos:
+                continue
+            c = match.group()
+            if self.in_string:
+                if c == '\\':
+                    escaped_pos = i + 1
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == '{':
+                self.depth += 1
+            elif c == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts[-1] = chunk[:i + 1]
+                    return True
+        self.escape_next = escaped_pos == len(chunk)
+        return False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def collect_json_stream(chunks: Iterable[str]) -> str:
+    """
+    Accumulate streamed reply text, stopping as soon as the first top-level
+    JSON object is complete so trailing tokens are not waited for.
+    """
+    scanner = _JsonStreamScanner()
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner.text
+
+
+def _validate_graph_fields(data: Dict) -> Optional[Dict]:
+    """Python checks for the Graph/Mindmap schema, used when jsonschema-rs is not installed."""
+    required_fields = ['nodes', 'hierarchy', 'edges']
+    for field in required_fields:
+        if field not in data:
+            print(f"Validation Error: Missing field '{field}'")
+            return None
+            
+    if not isinstance(data['nodes'], list):
+        print("Validation Error: 'nodes' must be a list")
+        return None
+
+    # Validate each node has an ID
+    for i, node in enumerate(data['nodes']):
+        if not isinstance(node, dict) or 'id' not in node:
+            print(f"Validation Error: Node at index {i} missing 'id' or not an object")
+            return None
+            
+    if not isinstance(data['edges'], list):
+        print("Validation Error: 'edges' must be a list")
+        return None
+
+    # Validate each edge has source/target
+    for i, edge in enumerate(data['edges']):
+        if not isinstance(edge, dict) or 'source' not in edge or 'target' not in edge:
+            print(f"Validation Error: Edge at index {i} missing source/target")
+            return None
+    
+    return data
+
+
 def validate_json(json_str: str) -> Optional[Dict]:
     """
     Validate and parse JSON from LLM response.
@@ -34,90 +285,90 @@ def validate_json(json_str: str) -> Optional[Dict]:
     """
     try:
         # Regex to find JSON block enclosed in ```json ... ``` or just { ... }
-        match = re.search(r'```json\s*(\{.*?\})\s*```', json_str, re.DOTALL)
+        match = _JSON_FENCED.search(json_str)
         if match:
             json_str = match.group(1)
         else:
             # Fallback: Try to find the first outer {} block
-            match_fallback = re.search(r'\{.*\}', json_str, re.DOTALL)
-            if match_fallback:
-                json_str = match_fallback.group(0)
+            extracted = _extract_json_object(json_str)
+            if extracted:
+                json_str = extracted
         
-        data = json.loads(json_str)
+        data = _loads(json_str)
         
-        # Determine schema validation type
-        if 'participants' in data and 'events' in data:
-            # Sequence Diagram Schema
-            if not isinstance(data.get('participants'), list):
-                print("Validation Error: 'participants' must be a list")
-                return None
-            if not isinstance(data.get('events'), list):
-                print("Validation Error: 'events' must be a list")
-                return None
-            return data
+        if not isinstance(data, dict):
+            print("Validation Error: top-level JSON must be an object")
+            return None
 
-        # Timeline Schema
-        if 'mermaid_syntax' in data:
+        # Dispatch on the first discriminator key present
+        keys = data.keys()
+        if 'mermaid_syntax' in keys:
+            # Timeline Schema
             return data
 
-        # Graph/Mindmap Schema (Fallback)
-        required_fields = ['nodes', 'hierarchy', 'edges']
-        for field in required_fields:
-            if field not in data:
-                print(f"Validation Error: Missing field '{field}'")
-                return None
-                
-        if not isinstance(data.get('nodes'), list):
-            print("Validation Error: 'nodes' must be a list")
-            return None
-
-        # Validate each node has an ID
-        for i, node in enumerate(data['nodes']):
-            if not isinstance(node, dict) or 'id' not in node:
-                print(f"Validation Error: Node at index {i} missing 'id' or not an object")
-                return None
-                
-        if not isinstance(data.get('edges'), list):
-            print("Validation Error: 'edges' must be a list")
+        if 'participants' in keys and 'events' in keys:
+            # Sequence Diagram Schema
+            if isinstance(data['participants'], list) and isinstance(data['events'], list):
+                return data
+            print("Validation Error: 'participants' and 'events' must be lists")
             return None
 
-        # Validate each edge has source/target
-        for i, edge in enumerate(data['edges']):
-            if not isinstance(edge, dict) or 'source' not in edge or 'target' not in edge:
-                print(f"Validation Error: Edge at index {i} missing source/target")
-                return None
-        
-        return data
-    except json.JSONDecodeError as e:
+        # Graph/Mindmap Schema (Fallback)
+        if GRAPH_SCHEMA_VALIDATOR is None:
+            return _validate_graph_fields(data)
+        if GRAPH_SCHEMA_VALIDATOR.is_valid(data):
+            return data
+        error = next(GRAPH_SCHEMA_VALIDATOR.iter_errors(data))
+        print(f"Validation Error: {error.message} at {'/'.join(map(str, error.instance_path)) or '<root>'}")
+        return None
+    except orjson.JSONDecodeError as e:
         print(f"JSON Decode Error: {e}")
         return None
 
 
-def inject_data_into_html(html_content: str, json_data: Dict) -> str:
+@lru_cache(maxsize=16)
+def _split_template(html_content: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a template around its injection block.
+    Cached so repeated injections into the same template skip the marker scan.
+    Returns (pre, post), or None if either marker is missing.
+    """
+    pre_content, sep, rest = html_content.partition(_START_MARKER)
+    if not sep:
+        return None
+    _, sep, post_content = rest.partition(_END_MARKER)
+    if not sep:
+        return None
+    return pre_content, post_content
+
+
+def serialize_for_html(json_data: Any) -> str:
+    """
+    Serialize compactly with </ escaped so the result can sit inside a <script>.
+    "<\\/" is a valid JSON escape, so the string still parses as the same data.
+    """
+    return _dumps(json_data).replace("</", "<\\/")
+
+
+def inject_data_into_html(html_content: str, json_data: Optional[Dict] = None,
+                          json_str: Optional[str] = None) -> str:
     """
     Inject JSON data into HTML template between markers.
     Markers: /* [INJECTION_START] */ and /* [INJECTION_END] */
+    Pass json_str (from serialize_for_html) when the data is already
+    serialized; it is used as-is.
     """
-    json_str = json.dumps(json_data, indent=2)
-    # Escape </script> to prevent breaking HTML
-    json_str = json_str.replace("</", "<\\/")
+    if json_str is None:
+        json_str = serialize_for_html(json_data)
 
-    start_marker = "/* [INJECTION_START] */"
-    end_marker = "/* [INJECTION_END] */"
-    
-    start_idx = html_content.find(start_marker)
-    end_idx = html_content.find(end_marker)
-    
-    if start_idx != -1 and end_idx != -1:
-        pre_content = html_content[:start_idx]
-        post_content = html_content[end_idx + len(end_marker):]
-        
-        new_block = f"{start_marker}\n            const architectureData = {json_str};\n            {end_marker}"
-        return pre_content + new_block + post_content
-    else:
+    parts = _split_template(html_content)
+    if parts is None:
         print("Could not find the insertion point in the HTML template.")
         return html_content
 
+    pre_content, post_content = parts
+    return f"{pre_content}{_START_MARKER}\n            const architectureData = {json_str};\n            {_END_MARKER}{post_content}"
+
 
 class DiagramGenerator:
     """Generator for various diagram types using Gemini."""
@@ -146,6 +397,9 @@ class DiagramGenerator:
         }
     }
     
+    # Gemini clients shared by all instances, keyed by API key
+    _models: Dict[str, Any] = {}
+    
     def __init__(self, api_key: str, base_path: str = "."):
         """
         Initialize the diagram generator.
@@ -156,13 +410,51 @@ class DiagramGenerator:
         """
         self.api_key = api_key
         self.base_path = base_path
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        if api_key not in self._models:
+            genai.configure(api_key=api_key)
+            self._models[api_key] = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        self.model = self._models[api_key]
+        # Absolute paths per diagram type, resolved once
+        self._paths = {
+            diagram_type: {
+                key: os.path.abspath(os.path.join(base_path, filename))
+                for key, filename in config.items()
+            }
+            for diagram_type, config in self.DIAGRAM_CONFIG.items()
+        }
     
-    def _get_path(self, filename: str) -> str:
-        """Get full path for a file."""
-        import os
-        return os.path.join(self.base_path, filename)
+    def _build_topic_prompt(self, topic: str, diagram_type: str) -> Tuple[Optional[str], Optional[str]]:
+        """Fill the generation prompt for a topic. Returns (prompt, error_message)."""
+        config = self.DIAGRAM_CONFIG.get(diagram_type)
+        if not config:
+            return None, f"Unknown diagram type: {diagram_type}"
+        
+        prompt_template = load_prompt(self._paths[diagram_type]["prompt"])
+        if not prompt_template:
+            return None, f"Prompt template not found: {config['prompt']}"
+        
+        return prompt_template.format_map({"topic": topic}), None
+    
+    def _render(self, json_data: Dict, diagram_type: str) -> Tuple[Optional[str], Optional[Dict], Optional[str]]:
+        """Inject validated JSON into the diagram template."""
+        config = self.DIAGRAM_CONFIG[diagram_type]
+        html_template = load_template(self._paths[diagram_type]["template"])
+        if html_template:
+            new_html = inject_data_into_html(html_template, json_data)
+            return new_html, json_data, None
+        else:
+            return None, json_data, f"HTML template not found: {config['template']}"
+    
+    def _finalize_topic_response(self, text: str, diagram_type: str, cache_key: str) -> Tuple[Optional[str], Optional[Dict], Optional[str]]:
+        """Validate a model reply, cache it and inject it into the diagram template."""
+        json_data = validate_json(text)
+        
+        if json_data:
+            put_cached_response(cache_key, json_data)
+            return self._render(json_data, diagram_type)
+        else:
+            raw_snippet = text[:500].replace('\n', ' ')
+            return None, None, f"Failed to generate valid JSON. Model output: {raw_snippet}..."
     
     def generate_from_topic(self, topic: str, diagram_type: str = "Graph") -> Tuple[Optional[str], Optional[Dict], Optional[str]]:
         """
@@ -175,34 +467,63 @@ class DiagramGenerator:
         Returns:
             Tuple of (html_content, json_data, error_message)
         """
-        config = self.DIAGRAM_CONFIG.get(diagram_type)
-        if not config:
-            return None, None, f"Unknown diagram type: {diagram_type}"
+        final_prompt, error = self._build_topic_prompt(topic, diagram_type)
+        if error:
+            return None, None, error
         
-        prompt_template = load_prompt(self._get_path(config["prompt"]))
-        if not prompt_template:
-            return None, None, f"Prompt template not found: {config['prompt']}"
+        cache_key = response_cache_key(final_prompt)
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            return self._render(cached, diagram_type)
         
-        final_prompt = prompt_template.replace("[INSERT TOPIC HERE]", topic)
+        try:
+            stream = self.model.generate_content(final_prompt, stream=True)
+            text = collect_json_stream(chunk.text for chunk in stream)
+            return self._finalize_topic_response(text, diagram_type, cache_key)
+        except Exception as e:
+            return None, None, f"Exception: {str(e)}"
+    
+    async def _generate_from_topic_async(self, topic: str, diagram_type: str,
+                                         semaphore: asyncio.Semaphore) -> Tuple[Optional[str], Optional[Dict], Optional[str]]:
+        """Async variant of generate_from_topic; the semaphore caps in-flight requests."""
+        final_prompt, error = self._build_topic_prompt(topic, diagram_type)
+        if error:
+            return None, None, error
+        
+        cache_key = response_cache_key(final_prompt)
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            return self._render(cached, diagram_type)
         
         try:
-            response = self.model.generate_content(final_prompt)
-            json_data = validate_json(response.text)
-            
-            if json_data:
-                html_template = load_template(self._get_path(config["template"]))
-                if html_template:
-                    new_html = inject_data_into_html(html_template, json_data)
-                    return new_html, json_data, None
-                else:
-                    return None, json_data, f"HTML template not found: {config['template']}"
-            else:
-                raw_snippet = response.text[:500].replace('\n', ' ')
-                return None, None, f"Failed to generate valid JSON. Model output: {raw_snippet}..."
-                
+            async with semaphore:
+                scanner = _JsonStreamScanner()
+                async for chunk in await self.model.generate_content_async(final_prompt, stream=True):
+                    if scanner.feed(chunk.text):
+                        break
+            return self._finalize_topic_response(scanner.text, diagram_type, cache_key)
         except Exception as e:
             return None, None, f"Exception: {str(e)}"
     
+    def generate_from_topics(self, topics: List[Tuple[str, str]]) -> List[Tuple[Optional[str], Optional[Dict], Optional[str]]]:
+        """
+        Generate several diagrams with the Gemini requests in flight concurrently.
+        
+        Args:
+            topics: (topic, diagram_type) pairs
+            
+        Returns:
+            One (html_content, json_data, error_message) tuple per topic, in order
+        """
+        async def generate_all():
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            return await asyncio.gather(*[
+                self._generate_from_topic_async(topic, diagram_type, semaphore)
+                for topic, diagram_type in topics
+            ])
+        
+        return list(asyncio.run(generate_all()))
+    
     def generate_from_json(self, json_data: Dict, diagram_type: str = "Sequence") -> Tuple[Optional[str], Optional[str]]:
         """
         Generate HTML from pre-built JSON data (from agent).
@@ -218,7 +539,7 @@ class DiagramGenerator:
         if not config:
             return None, f"Unknown diagram type: {diagram_type}"
         
-        html_template = load_template(self._get_path(config["template"]))
+        html_template = load_template(self._paths[diagram_type]["template"])
         if not html_template:
             return None, f"HTML template not found: {config['template']}"
         
@@ -244,27 +565,32 @@ class DiagramGenerator:
         if not config:
             return None, None, f"Unknown diagram type: {diagram_type}"
         
-        modification_prompt = load_prompt(self._get_path(config.get("modification_prompt", "modification_prompt.txt")))
+        modification_prompt = load_prompt(self._paths[diagram_type]["modification_prompt"])
         if not modification_prompt:
             return None, None, "Modification prompt template not found"
         
-        final_prompt = modification_prompt.replace("[INSERT CURRENT JSON DATA HERE]", json.dumps(current_json))
-        final_prompt = final_prompt.replace("[INSERT CHANGE REQUEST HERE]", change_request)
+        final_prompt = modification_prompt.format_map({
+            "current_json": _dumps(current_json),
+            "change_request": change_request
+        })
+        
+        cache_key = response_cache_key(final_prompt)
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            return self._render(cached, diagram_type)
         
         try:
-            response = self.model.generate_content(final_prompt)
-            content = response.text
-            content = re.sub(r'```json\s*', '', content)
-            content = re.sub(r'```\s*$', '', content)
+            stream = self.model.generate_content(final_prompt, stream=True)
+            content = collect_json_stream(chunk.text for chunk in stream)
+            content = strip_code_fence(content)
             
-            new_json_data = json.loads(content)
+            new_json_data = validate_json(content)
+            if not new_json_data:
+                raw_snippet = content[:500].replace('\n', ' ')
+                return None, None, f"Failed to generate valid JSON. Model output: {raw_snippet}..."
+            put_cached_response(cache_key, new_json_data)
             
-            html_template = load_template(self._get_path(config["template"]))
-            if html_template:
-                new_html = inject_data_into_html(html_template, new_json_data)
-                return new_html, new_json_data, None
-            else:
-                return None, new_json_data, f"HTML template not found: {config['template']}"
+            return self._render(new_json_data, diagram_type)
                 
         except Exception as e:
             return None, None, str(e)
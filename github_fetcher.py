@@ -0,0 +1,515 @@
+"""
+GitHub Fetcher Module
+Async GitHub API client and concurrent file content downloads for the repo analyzer
+"""
+
+import asyncio
+import base64
+import os
+import queue
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import aiohttp
+import requests
+
+from repo_cache import RepoCache
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+GITHUB_CLONE_URL = "https://github.com"
+
+# Bulk downloads use a partial clone over git's smart protocol when git is installed
+GIT_AVAILABLE = shutil.which("git") is not None
+
+# Concurrency cap for api.github.com; workers pull SHAs from a shared queue
+MAX_CONNECTIONS_PER_HOST = 64
+MAX_RETRIES = 5
+
+# Files per GraphQL query, and how many queries may be in flight at once
+# (GraphQL is more prone to secondary rate limits than REST)
+GRAPHQL_BATCH_SIZE = 50
+GRAPHQL_CONCURRENCY = 4
+
+# A spent quota that resets later than this is reported instead of waited out,
+# so an anonymous run fails with a message rather than hanging for up to an hour
+MAX_RATE_LIMIT_WAIT = 60
+
+# Repositories with fewer blobs than this are fetched as a single tarball
+TARBALL_MAX_ENTRIES = 5000
+
+# The raw media type returns blob bytes directly instead of base64-in-JSON
+_RAW_ACCEPT = {"Accept": "application/vnd.github.raw"}
+
+
+def _decode_text(data: bytes) -> Optional[str]:
+    """Decode blob bytes as UTF-8, or return None if they look binary (NUL in the first 8 KB)."""
+    if b"\x00" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def _headers(token: Optional[str]) -> Dict[str, str]:
+    headers = {"X-GitHub-Api-Version": "2022-11-28"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+
+def _is_throttled(response: aiohttp.ClientResponse) -> bool:
+    """429, or a 403 carrying Retry-After (secondary rate limit); any other 403 is a refusal."""
+    return response.status == 429 or (response.status == 403 and "Retry-After" in response.headers)
+
+
+def _retry_delay(response: aiohttp.ClientResponse, attempt: int) -> float:
+    """Seconds to wait before retrying a throttled or failed request."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset_at = response.headers.get("X-RateLimit-Reset", "")
+        if reset_at.isdigit():
+            return max(float(reset_at) - time.time(), 1.0)
+    return float(2 ** attempt)
+
+
+class GHLimiter:
+    """
+    Rate-limit state shared by every request on one client.
+
+    Responses update the remaining quota from the X-RateLimit-* headers.
+    When the quota runs out, or GitHub asks a caller to back off, the limiter
+    pauses and every request entering it waits until the pause ends, instead
+    of each one separately running into the limit. A quota that resets more
+    than MAX_RATE_LIMIT_WAIT seconds away is not waited for: until the reset,
+    requests entering the limiter raise GitHubAPIError(403) instead.
+    """
+
+    def __init__(self):
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+        self.exhausted_until = 0.0
+        self._open = asyncio.Event()
+        self._open.set()
+        self._resume_at = 0.0
+        self._resume_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def exhausted(self) -> bool:
+        return time.time() < self.exhausted_until
+
+    async def __aenter__(self) -> None:
+        if self.exhausted:
+            raise GitHubAPIError(403, "API rate limit exceeded")
+        await self._open.wait()
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    def update(self, response: aiohttp.ClientResponse) -> None:
+        """Record the quota headers of a response; pause (or give up) once the quota is spent."""
+        remaining = response.headers.get("X-RateLimit-Remaining", "")
+        reset_at = response.headers.get("X-RateLimit-Reset", "")
+        if remaining.isdigit():
+            self.remaining = int(remaining)
+        if reset_at.isdigit():
+            self.reset_at = float(reset_at)
+        if self.remaining == 0:
+            wait = self.reset_at - time.time()
+            if wait > MAX_RATE_LIMIT_WAIT:
+                self.exhausted_until = self.reset_at
+            else:
+                self.pause(max(wait, 1.0))
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all requests for at least the given number of seconds."""
+        loop = asyncio.get_running_loop()
+        resume_at = loop.time() + seconds
+        if resume_at <= self._resume_at:
+            return
+        if self._resume_handle is not None:
+            self._resume_handle.cancel()
+        self._resume_at = resume_at
+        self._open.clear()
+        self._resume_handle = loop.call_at(resume_at, self._open.set)
+
+
+class GitHubAPIError(Exception):
+    """Non-retryable error response from the GitHub REST API."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class GH:
+    """
+    Minimal async client for the REST endpoints the analyzer needs.
+    Returns plain JSON instead of lazily-loading wrapper objects.
+
+    REST and GraphQL requests are throttled by separate limiters, since
+    GitHub tracks their quotas separately. With a response cache, lookups of
+    mutable resources (repository, branch) are sent with If-None-Match;
+    a 304 reply is served from the cache and does not count against the
+    rate limit.
+
+    Usage:
+        async with GH(token) as gh:
+            repo = await gh.repo("owner/repo")
+    """
+
+    def __init__(self, token: Optional[str] = None, response_cache: Optional[RepoCache] = None):
+        connector = aiohttp.TCPConnector(limit_per_host=MAX_CONNECTIONS_PER_HOST)
+        self.session = aiohttp.ClientSession(headers=_headers(token), connector=connector)
+        self.limiter = GHLimiter()
+        self.graphql_limiter = GHLimiter()
+        self.response_cache = response_cache
+
+    async def __aenter__(self) -> "GH":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.session.close()
+
+    async def _get(self, path: str, params: Optional[Dict[str, str]] = None,
+                   conditional: bool = False) -> Any:
+        """
+        GET a JSON endpoint, retrying throttled and transient failures.
+        With conditional=True the request is revalidated against the
+        response cache instead of always downloading the body.
+        """
+        url = f"{GITHUB_API_URL}{path}"
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        cached = self.response_cache.get_response(url) if conditional and self.response_cache else None
+        headers = {"If-None-Match": cached[0]} if cached else None
+        for attempt in range(MAX_RETRIES):
+            try:
+                async with self.limiter, self.session.get(url, headers=headers) as response:
+                    self.limiter.update(response)
+                    if response.status == 304 and cached:
+                        return cached[1]
+                    if response.status == 200:
+                        body = await response.json()
+                        etag = response.headers.get("ETag")
+                        if conditional and self.response_cache and etag:
+                            self.response_cache.put_response(url, etag, body)
+                        return body
+                    # A primary rate limit without Retry-After can last up to an hour; surface it
+                    throttled = _is_throttled(response)
+                    if not (throttled or response.status >= 500) or attempt == MAX_RETRIES - 1:
+                        try:
+                            message = (await response.json()).get("message", response.reason)
+                        except (aiohttp.ContentTypeError, ValueError):
+                            message = response.reason
+                        raise GitHubAPIError(response.status, message)
+                    if throttled:
+                        self.limiter.pause(_retry_delay(response, attempt))
+                        continue
+            except aiohttp.ClientError as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise GitHubAPIError(0, str(e))
+            await asyncio.sleep(2 ** attempt)
+
+    async def repo(self, repo_full_name: str) -> Dict[str, Any]:
+        """Repository metadata (name, description, default_branch, ...)."""
+        return await self._get(f"/repos/{repo_full_name}", conditional=True)
+
+    async def branch_head(self, repo_full_name: str, branch: str) -> str:
+        """SHA of the commit a branch points at."""
+        branch_data = await self._get(f"/repos/{repo_full_name}/branches/{branch}", conditional=True)
+        return branch_data["commit"]["sha"]
+
+    async def tree(self, repo_full_name: str, tree_sha: str, recursive: bool = False) -> Dict[str, Any]:
+        """Git tree listing with "tree" entries and a "truncated" flag."""
+        params = {"recursive": "1"} if recursive else None
+        return await self._get(f"/repos/{repo_full_name}/git/trees/{tree_sha}", params)
+
+    async def blob(self, repo_full_name: str, sha: str) -> Optional[bytes]:
+        """Raw blob bytes, or None if the download failed."""
+        url = f"{GITHUB_API_URL}/repos/{repo_full_name}/git/blobs/{sha}"
+        for attempt in range(MAX_RETRIES):
+            try:
+                async with self.limiter, self.session.get(url, headers=_RAW_ACCEPT) as response:
+                    self.limiter.update(response)
+                    if response.status == 200:
+                        return await response.read()
+                    if _is_throttled(response):
+                        # Every worker on this client waits, not just this one
+                        self.limiter.pause(_retry_delay(response, attempt))
+                        continue
+                    if self.limiter.exhausted:
+                        raise GitHubAPIError(response.status, "API rate limit exceeded")
+                    if response.status < 500:
+                        return None
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(2 ** attempt)
+        return None
+
+
+async def _fetch_blob_texts(gh: GH, repo_full_name: str, shas: Iterable[str],
+                            emit: Callable[[Dict[str, Optional[str]]], None]) -> None:
+    """
+    Fetch blobs with a pool of queue-fed workers, handing each {sha: text}
+    to emit as it arrives. Each blob is decoded as soon as it downloads, so
+    the raw bytes are released immediately; binary blobs are emitted as None
+    and failed downloads not at all.
+    """
+    sha_queue: asyncio.Queue = asyncio.Queue()
+    for sha in shas:
+        sha_queue.put_nowait(sha)
+
+    async def worker():
+        while True:
+            try:
+                sha = sha_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            data = await gh.blob(repo_full_name, sha)
+            if data is not None:
+                emit({sha: _decode_text(data)})
+
+    await asyncio.gather(*[
+        worker() for _ in range(min(MAX_CONNECTIONS_PER_HOST, sha_queue.qsize()))
+    ])
+
+
+def _build_graphql_query(count: int) -> str:
+    """Query with one aliased object(expression:) field per file."""
+    variables = "".join(f", $e{i}: String!" for i in range(count))
+    fields = " ".join(
+        f"f{i}: object(expression: $e{i}) {{ ... on Blob {{ text isBinary isTruncated }} }}"
+        for i in range(count)
+    )
+    return f"query($owner: String!, $name: String!{variables}) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}"
+
+
+async def _fetch_texts_graphql(gh: GH, semaphore: asyncio.Semaphore,
+                               repo_full_name: str, ref: str,
+                               batch: List[Tuple[str, str]]) -> Dict[str, str]:
+    """
+    Fetch the text of up to GRAPHQL_BATCH_SIZE files in one GraphQL request.
+    Returns sha -> text; binary, truncated or failed entries are left out.
+    """
+    owner, name = repo_full_name.split("/", 1)
+    variables = {"owner": owner, "name": name}
+    for i, (path, _) in enumerate(batch):
+        variables[f"e{i}"] = f"{ref}:{path}"
+    payload = {"query": _build_graphql_query(len(batch)), "variables": variables}
+    limiter = gh.graphql_limiter
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with semaphore, limiter, gh.session.post(GITHUB_GRAPHQL_URL, json=payload) as response:
+                limiter.update(response)
+                if response.status == 200:
+                    body = await response.json()
+                    break
+                if _is_throttled(response):
+                    limiter.pause(_retry_delay(response, attempt))
+                    continue
+                if response.status < 500:
+                    return {}
+        except aiohttp.ClientError:
+            pass
+        except GitHubAPIError:
+            # GraphQL quota spent; the REST fallback picks these files up
+            return {}
+        await asyncio.sleep(2 ** attempt)
+    else:
+        return {}
+
+    repository = (body.get("data") or {}).get("repository") or {}
+    texts = {}
+    for i, (_, sha) in enumerate(batch):
+        blob = repository.get(f"f{i}")
+        if blob and blob.get("text") is not None and not blob.get("isBinary") and not blob.get("isTruncated"):
+            texts[sha] = blob["text"]
+    return texts
+
+
+async def _fetch_file_texts_async(repo_full_name: str, files: List[Tuple[str, str]],
+                                  token: Optional[str], ref: str,
+                                  emit: Callable[[Dict[str, Optional[str]]], None]) -> None:
+    """Fetch file texts, handing each {sha: text} batch to emit as soon as it arrives."""
+    # Identical contents at several paths only need fetching once
+    files = list({sha: (path, sha) for path, sha in files}.values())
+    fetched = set()
+    async with GH(token) as gh:
+        # GraphQL needs authentication; anonymous callers go straight to REST
+        if token:
+            semaphore = asyncio.Semaphore(GRAPHQL_CONCURRENCY)
+            for next_batch in asyncio.as_completed([
+                _fetch_texts_graphql(gh, semaphore, repo_full_name, ref,
+                                     files[start:start + GRAPHQL_BATCH_SIZE])
+                for start in range(0, len(files), GRAPHQL_BATCH_SIZE)
+            ]):
+                batch = await next_batch
+                fetched.update(batch)
+                emit(batch)
+
+        missing = {sha for _, sha in files if sha not in fetched}
+        if missing:
+            await _fetch_blob_texts(gh, repo_full_name, missing, emit)
+
+
+def iter_file_texts(repo_full_name: str, files: List[Tuple[str, str]],
+                    token: Optional[str] = None, ref: str = "HEAD") -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Download file contents as text, yielding {sha: text} batches as they arrive.
+
+    With a token, files are fetched GRAPHQL_BATCH_SIZE at a time through
+    aliased object(expression:) queries; anything GraphQL cannot return as
+    text (binary, truncated, failed batch) falls back to the REST blobs API.
+    Binary files come back as None, and files that could not be downloaded
+    are missing from the batches altogether.
+    The download runs on a background thread, so the caller can process
+    earlier files while later ones are still in flight.
+
+    Args:
+        repo_full_name: Repository as owner/name
+        files: (path, sha) pairs to fetch
+        token: Optional GitHub token
+        ref: Branch, tag or commit the paths are resolved against
+    """
+    batches: queue.Queue = queue.Queue()
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(_fetch_file_texts_async(repo_full_name, files, token, ref, batches.put))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            batches.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while (batch := batches.get()) is not None:
+        yield batch
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def iter_tarball_texts(repo_full_name: str, ref: str, files: Dict[str, str],
+                       token: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Download the repository archive in one streamed request and yield
+    (sha, text) for the wanted files as they are read out of it, without
+    writing the archive to disk.
+
+    Args:
+        repo_full_name: Repository as owner/name
+        ref: Branch, tag or commit to archive
+        files: Mapping of path to blob SHA for the files to keep
+        token: Optional GitHub token
+
+    Yields:
+        (blob SHA, decoded text); stops early if the download fails, so
+        callers can fall back to iter_file_texts for whatever is missing
+    """
+    url = f"{GITHUB_API_URL}/repos/{repo_full_name}/tarball/{ref}"
+    try:
+        with requests.get(url, headers=_headers(token), stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                for member in archive:
+                    # Members are prefixed with an "owner-repo-sha/" directory
+                    sha = files.get(member.name.partition("/")[2])
+                    if sha is None or not member.isfile():
+                        continue
+                    text = _decode_text(archive.extractfile(member).read())
+                    if text is not None:
+                        yield sha, text
+    except (requests.RequestException, tarfile.TarError):
+        return
+
+
+def _git_env(token: Optional[str]) -> Dict[str, str]:
+    """Environment for git subprocesses; the token goes through config env vars, never argv."""
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0", "GIT_NO_LAZY_FETCH": "1"}
+    if token:
+        credentials = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+        env.update(
+            GIT_CONFIG_COUNT="1",
+            GIT_CONFIG_KEY_0="http.extraHeader",
+            GIT_CONFIG_VALUE_0=f"Authorization: Basic {credentials}"
+        )
+    return env
+
+
+def _cat_blobs(git_dir: str, shas: Iterable[str], env: Dict[str, str]) -> Iterator[Tuple[str, str]]:
+    """Stream blobs out of a repository with a single git cat-file --batch process."""
+    process = subprocess.Popen(
+        ["git", "--git-dir", git_dir, "cat-file", "--batch"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env
+    )
+
+    # Feed SHAs from a thread so a full stdout pipe cannot deadlock the writes
+    def feed():
+        try:
+            with process.stdin:
+                for sha in shas:
+                    process.stdin.write(f"{sha}\n".encode())
+        except OSError:
+            pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    try:
+        while header := process.stdout.readline():
+            # "<sha> blob <size>" followed by the content, or "<sha> missing"
+            fields = header.split()
+            if len(fields) != 3:
+                continue
+            data = process.stdout.read(int(fields[2]))
+            process.stdout.read(1)
+            text = _decode_text(data)
+            if text is not None:
+                yield fields[0].decode(), text
+    finally:
+        process.kill()
+        process.wait()
+        writer.join()
+
+
+def iter_clone_texts(repo_full_name: str, shas: Iterable[str], token: Optional[str] = None,
+                     max_blob_size: int = 100 * 1024) -> Iterator[Tuple[str, str]]:
+    """
+    Shallow, blob-filtered clone of the default branch into a temporary
+    directory, then yield the wanted blobs out of it. One pack-file transfer
+    replaces per-file API requests and does not touch the API rate limit.
+
+    Args:
+        repo_full_name: Repository as owner/name
+        shas: Blob SHAs to read
+        token: Optional GitHub token
+        max_blob_size: Larger blobs are left out of the clone
+
+    Yields:
+        (blob SHA, decoded text); nothing if git is missing or the clone
+        fails, so callers can fall back to iter_file_texts
+    """
+    if not GIT_AVAILABLE:
+        return
+    env = _git_env(token)
+    with tempfile.TemporaryDirectory() as git_dir:
+        try:
+            subprocess.run(
+                ["git", "clone", "--quiet", "--bare", "--depth", "1",
+                 f"--filter=blob:limit={max_blob_size + 1}",
+                 f"{GITHUB_CLONE_URL}/{repo_full_name}.git", git_dir],
+                env=env, check=True, capture_output=True, timeout=600
+            )
+        except (subprocess.SubprocessError, OSError):
+            return
+        yield from _cat_blobs(git_dir, shas, env)
@@ -1,13 +1,21 @@
 import streamlit as st
+import asyncio
+import hashlib
 import os
-import tempfile
-import shutil
+import re
+import threading
+from collections import OrderedDict, defaultdict
 from dotenv import load_dotenv
-from github import Github, GithubException
-from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from agent.rag_pipeline import RAGPipeline
 from agent.repo_agent import RepoAnalysisAgent
 from diagram_generator import DiagramGenerator
+from github_fetcher import (
+    GH, GIT_AVAILABLE, GRAPHQL_BATCH_SIZE, TARBALL_MAX_ENTRIES, GitHubAPIError,
+    iter_clone_texts, iter_file_texts, iter_tarball_texts
+)
+from repo_cache import RepoCache
 
 # Load environment variables
 load_dotenv(override=True)
@@ -32,6 +40,20 @@ INCLUDED_EXTENSIONS = {
     '.dockerfile', '.docker-compose.yml'
 }
 
+# Syntax highlighting language for st.code, by extension
+EXT_TO_LANG = {
+    '.py': 'python', '.js': 'javascript', '.jsx': 'jsx', '.ts': 'typescript', '.tsx': 'tsx',
+    '.java': 'java', '.go': 'go', '.rs': 'rust', '.rb': 'ruby', '.php': 'php',
+    '.c': 'c', '.cpp': 'cpp', '.h': 'c', '.hpp': 'cpp', '.cs': 'csharp',
+    '.swift': 'swift', '.kt': 'kotlin', '.scala': 'scala', '.clj': 'clojure',
+    '.html': 'html', '.css': 'css', '.scss': 'scss', '.sass': 'sass', '.less': 'less',
+    '.json': 'json', '.yaml': 'yaml', '.yml': 'yaml', '.toml': 'toml', '.xml': 'xml',
+    '.ini': 'ini', '.cfg': 'ini',
+    '.md': 'markdown', '.rst': 'rest', '.sql': 'sql', '.graphql': 'graphql',
+    '.sh': 'bash', '.bash': 'bash', '.zsh': 'bash', '.ps1': 'powershell',
+    '.dockerfile': 'docker'
+}
+
 # Directories to ignore
 IGNORED_DIRS = {
     'node_modules', '.git', '__pycache__', '.venv', 'venv', 'env',
@@ -46,45 +68,107 @@ IGNORED_FILES = {
     'poetry.lock', 'Gemfile.lock', 'composer.lock'
 }
 
+# Common config files without extensions
+INCLUDED_FILENAMES = frozenset({
+    'dockerfile', 'makefile', 'rakefile', 'gemfile', 'procfile',
+    'vagrantfile', 'jenkinsfile', '.gitignore', '.env.example'
+})
+
 # Maximum file size to process (in bytes)
 MAX_FILE_SIZE = 100 * 1024  # 100KB
 
+# Analyzed commits kept for the results view, shared by every session that
+# analyzed them; older ones have to be analyzed again
+MAX_STORED_REPOS = 16
+
+# Matches any path component that is an ignored directory, in one scan
+_IGNORED_RE = re.compile(
+    r'(?:^|/)(?:' + '|'.join(re.escape(d) for d in sorted(IGNORED_DIRS)) + r')(?:/|$)'
+)
+
+
+def _is_candidate(file_path: str, file_size: int) -> bool:
+    """Cheap path and size checks, applied while the tree listing is read."""
+    return (
+        file_size <= MAX_FILE_SIZE
+        and not _IGNORED_RE.search(file_path)
+        and file_path.rpartition('/')[2] not in IGNORED_FILES
+    )
+
+
+def _has_included_type(file_path: str) -> bool:
+    """Check the extension (or extension-less config file name) of a path."""
+    name = file_path.rpartition('/')[2]
+    return os.path.splitext(name)[1].lower() in INCLUDED_EXTENSIONS or name.lower() in INCLUDED_FILENAMES
+
 
 def should_include_file(file_path: str, file_size: int) -> bool:
     """Check if a file should be included in analysis."""
-    path = Path(file_path)
-    
-    # Check if in ignored directory
-    for part in path.parts:
-        if part in IGNORED_DIRS:
-            return False
-    
-    # Check if ignored file
-    if path.name in IGNORED_FILES:
-        return False
-    
-    # Check file size
-    if file_size > MAX_FILE_SIZE:
-        return False
+    return _is_candidate(file_path, file_size) and _has_included_type(file_path)
+
+
+async def _walk_tree(gh: GH, full_name: str, tree_sha: str, prefix: str,
+                     entries: List[Tuple[str, str, int]]) -> int:
+    """
+    Collect (path, sha, size) for every candidate blob under a tree.
+    Tries one recursive Trees API call; if GitHub truncates the listing,
+    lists this level only and walks each subtree concurrently,
+    never descending into ignored directories.
     
-    # Check extension (also include files without extension like Dockerfile, Makefile)
-    ext = path.suffix.lower()
-    name = path.name.lower()
+    Returns:
+        Number of blobs seen, including pruned ones
+    """
+    tree = await gh.tree(full_name, tree_sha, recursive=True)
+    if not tree['truncated']:
+        blobs = [element for element in tree['tree'] if element['type'] == 'blob']
+        entries.extend(
+            (path, element['sha'], element['size'])
+            for element in blobs
+            if _is_candidate(path := prefix + element['path'], element['size'])
+        )
+        return len(blobs)
     
-    if ext in INCLUDED_EXTENSIONS:
-        return True
+    blob_count = 0
+    subtrees = []
+    for element in (await gh.tree(full_name, tree_sha))['tree']:
+        if element['type'] == 'blob':
+            blob_count += 1
+            path = prefix + element['path']
+            if _is_candidate(path, element['size']):
+                entries.append((path, element['sha'], element['size']))
+        elif element['type'] == 'tree' and element['path'] not in IGNORED_DIRS:
+            subtrees.append((element['sha'], f"{prefix}{element['path']}/", []))
     
-    # Include common config files without extensions
-    if name in {'dockerfile', 'makefile', 'rakefile', 'gemfile', 'procfile', 
-                'vagrantfile', 'jenkinsfile', '.gitignore', '.env.example'}:
-        return True
+    # Each subtree fills its own list so the final order stays deterministic
+    counts = await asyncio.gather(*[
+        _walk_tree(gh, full_name, sha, sub_prefix, sub_entries)
+        for sha, sub_prefix, sub_entries in subtrees
+    ])
+    for _, _, sub_entries in subtrees:
+        entries.extend(sub_entries)
+    return blob_count + sum(counts)
+
+
+async def _list_repo_blobs_async(full_name: str, ref: str, github_token: str = None):
+    entries = []
+    async with GH(github_token) as gh:
+        blob_count = await _walk_tree(gh, full_name, ref, "", entries)
+    return entries, blob_count
+
+
+def list_repo_blobs(full_name: str, ref: str, github_token: str = None) -> Tuple[List[Tuple[str, str, int]], int]:
+    """
+    List candidate files at ref via the Git Trees API.
+    Ignored directories/files and oversized blobs are pruned while reading the listing.
     
-    return False
+    Returns:
+        ((path, sha, size) candidates, total number of blobs seen)
+    """
+    return asyncio.run(_list_repo_blobs_async(full_name, ref, github_token))
 
 
-def fetch_repo_contents(repo_url: str, github_token: str = None) -> dict:
-    """Fetch repository contents from GitHub."""
-    # Parse repo URL to get owner/repo
+def _parse_repo_path(repo_url: str) -> str:
+    """Normalize a GitHub URL or owner/repo string to owner/repo."""
     # Handle formats: https://github.com/owner/repo or owner/repo
     repo_url = repo_url.strip()
     if repo_url.startswith('https://github.com/'):
@@ -97,70 +181,229 @@ def fetch_repo_contents(repo_url: str, github_token: str = None) -> dict:
     # Remove .git suffix if present
     if repo_path.endswith('.git'):
         repo_path = repo_path[:-4]
-    
-    # Initialize GitHub client
-    if github_token:
-        g = Github(github_token)
-    else:
-        g = Github()  # Anonymous access (rate limited)
-    
+    return repo_path
+
+
+async def _resolve_head_async(repo_path: str, github_token: str = None):
+    # Anonymous access works for public repos but is heavily rate limited;
+    # revalidated lookups of an unchanged repo do not count against it
+    async with GH(github_token, response_cache=RepoCache()) as gh:
+        repo = await gh.repo(repo_path)
+        head_sha = await gh.branch_head(repo['full_name'], repo['default_branch'])
+    return repo, head_sha
+
+
+def _resolve_head(repo_path: str, github_token: str = None):
+    """Look up the repository and its default-branch head commit SHA (two cheap API calls)."""
     try:
-        repo = g.get_repo(repo_path)
-    except GithubException as e:
+        return asyncio.run(_resolve_head_async(repo_path, github_token))
+    except GitHubAPIError as e:
         if e.status == 404:
             raise ValueError(f"Repository not found: {repo_path}. Check the URL or provide a GitHub token for private repos.")
         elif e.status == 403:
             raise ValueError("Rate limit exceeded or access denied. Please provide a GitHub token.")
         else:
-            raise ValueError(f"GitHub API error: {e.data.get('message', str(e))}")
+            raise ValueError(f"GitHub API error: {e.message}")
+
+
+def _token_hash(github_token: str = None) -> str:
+    # Key caches on a hash so the token itself never ends up in a cache key
+    return hashlib.sha256(github_token.encode()).hexdigest() if github_token else ""
+
+
+def _list_included(full_name: str, head_sha: str, github_token: str = None) -> Tuple[List[Tuple[str, str, int]], int]:
+    """
+    List the files to analyze at a commit.
     
-    files = {}
-    file_count = 0
-    skipped_count = 0
+    Returns:
+        ((path, sha, size) included files, total number of blobs in the tree)
+    """
+    cache = RepoCache()
     
-    def fetch_contents(path=""):
-        nonlocal file_count, skipped_count
-        try:
-            contents = repo.get_contents(path)
-        except GithubException:
-            return
-        
-        for content in contents:
-            if content.type == "dir":
-                # Skip ignored directories
-                if content.name in IGNORED_DIRS:
-                    continue
-                fetch_contents(content.path)
-            else:
-                if should_include_file(content.path, content.size):
-                    try:
-                        file_content = content.decoded_content.decode('utf-8', errors='ignore')
-                        files[content.path] = {
-                            'content': file_content,
-                            'size': content.size,
-                            'sha': content.sha
-                        }
-                        file_count += 1
-                    except Exception:
-                        skipped_count += 1
-                else:
-                    skipped_count += 1
+    # Tree listings are cached per commit, so an unchanged repo skips the Trees API
+    try:
+        listing = cache.get_tree(full_name, head_sha)
+        if listing is None:
+            listing = list_repo_blobs(full_name, head_sha, github_token)
+            cache.put_tree(full_name, head_sha, *listing)
+        entries, blob_count = listing
+    except GitHubAPIError as e:
+        raise ValueError(f"Could not list repository files: {e.message}")
+    
+    return [entry for entry in entries if _has_included_type(entry[0])], blob_count
+
+
+def stream_repo_files(full_name: str, head_sha: str, included: List[Tuple[str, str, int]],
+                      blob_count: int, github_token: str = None,
+                      failed: Optional[List[str]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (path, file data) for the included files as their contents become
+    available: cached blobs first, then downloads as each batch arrives.
+    Binary files are left out; paths that could not be downloaded at all
+    are appended to failed once the stream ends.
+    """
+    cache = RepoCache()
+    pending = defaultdict(list)
+    for path, sha, size in included:
+        pending[sha].append((path, size))
+    
+    def emit(texts):
+        for sha, text in texts:
+            paths = pending.pop(sha, ())
+            if text is None:
+                continue
+            for path, size in paths:
+                yield path, {
+                    'content': text,
+                    'size': size,
+                    'sha': sha,
+                    'lang': EXT_TO_LANG.get(os.path.splitext(path)[1].lower(), 'text')
+                }
     
-    fetch_contents()
+    # Blob SHAs are content hashes, so cached texts are always current
+    yield from emit(cache.get_blobs(list(pending)).items())
     
+    # Bulk download through a partial clone, or as one tarball for small repos
+    # without git; a few misses fit in a single GraphQL batch anyway
+    if len(pending) > GRAPHQL_BATCH_SIZE:
+        if GIT_AVAILABLE:
+            bulk = iter_clone_texts(full_name, list(pending), github_token, MAX_FILE_SIZE)
+        elif blob_count < TARBALL_MAX_ENTRIES:
+            wanted = {path: sha for sha, paths in pending.items() for path, _ in paths}
+            bulk = iter_tarball_texts(full_name, head_sha, wanted, github_token)
+        else:
+            bulk = ()
+        fetched = []
+        for sha, text in bulk:
+            fetched.append((sha, text))
+            yield from emit([(sha, text)])
+        cache.put_blobs(fetched)
+    
+    if pending:
+        missing = [(paths[0][0], sha) for sha, paths in pending.items()]
+        fetched = []
+        for batch in iter_file_texts(full_name, missing, github_token, ref=head_sha):
+            fetched.extend((sha, text) for sha, text in batch.items() if text is not None)
+            yield from emit(batch.items())
+        cache.put_blobs(fetched)
+    
+    # Whatever the REST fallback could not return either failed to download
+    if failed is not None:
+        failed.extend(path for paths in pending.values() for path, _ in paths)
+
+
+def _collect(stream: Iterator[Tuple[str, Dict[str, Any]]], files: dict) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Pass (path, file data) pairs through, recording each in files."""
+    for path, file_data in stream:
+        files[path] = file_data
+        yield path, file_data
+
+
+def _repo_data(repo: dict, head_sha: str, files: dict, blob_count: int, failed: List[str]) -> dict:
     return {
-        'name': repo.name,
-        'full_name': repo.full_name,
-        'description': repo.description or "No description",
-        'language': repo.language,
-        'stars': repo.stargazers_count,
-        'default_branch': repo.default_branch,
+        'name': repo['name'],
+        'full_name': repo['full_name'],
+        'description': repo['description'] or "No description",
+        'language': repo['language'],
+        'stars': repo['stargazers_count'],
+        'default_branch': repo['default_branch'],
+        'head_sha': head_sha,
         'files': files,
-        'file_count': file_count,
-        'skipped_count': skipped_count
+        'file_count': len(files),
+        'failed_files': sorted(failed),
+        'skipped_count': blob_count - len(files) - len(failed)
     }
 
 
+class _IncompleteRepository(Exception):
+    """Carries a partially downloaded result out of the cached loader, so it is used once but never cached."""
+    
+    def __init__(self, result: Tuple[dict, RAGPipeline]):
+        super().__init__(f"{len(result[0]['failed_files'])} files could not be downloaded")
+        self.result = result
+
+
+def load_repository(repo_url: str, github_token: str = None) -> Tuple[dict, RAGPipeline]:
+    """
+    Fetch a repository and build its RAG index in one pass.
+    Files are split and embedded while later ones are still downloading.
+    
+    Returns:
+        (repository data, indexed pipeline)
+    """
+    repo, head_sha = _resolve_head(_parse_repo_path(repo_url), github_token)
+    try:
+        return _load_repository_cached(repo['full_name'], head_sha, _token_hash(github_token), repo, github_token)
+    except _IncompleteRepository as e:
+        # Pressing Analyze again retries the missing files
+        return e.result
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_repository_cached(full_name: str, head_sha: str, token_hash: str,
+                            _repo, _github_token: str) -> Tuple[dict, RAGPipeline]:
+    """Fetch and index one commit once and share the result across reruns."""
+    included, blob_count = _list_included(full_name, head_sha, _github_token)
+    files = {}
+    failed = []
+    rag = RAGPipeline()
+    try:
+        rag.build_index(_collect(stream_repo_files(full_name, head_sha, included, blob_count, _github_token, failed), files))
+    except GitHubAPIError:
+        raise ValueError("Rate limit exceeded or access denied. Please provide a GitHub token.")
+    result = _repo_data(_repo, head_sha, files, blob_count, failed), rag
+    if failed:
+        # Exceptions are not cached, so a transient download error is not pinned
+        raise _IncompleteRepository(result)
+    return result
+
+
+class _RepoStore:
+    """
+    Process-wide LRU of repository data and its sorted file paths, keyed by
+    (full_name, head_sha). Only the key is kept in session state, so the
+    file contents never live in st.session_state itself.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[dict, List[str]]]" = OrderedDict()
+    
+    def put(self, key: Tuple[str, str], repo_data: dict) -> None:
+        entry = repo_data, sorted(repo_data['files'])
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > MAX_STORED_REPOS:
+                self._entries.popitem(last=False)
+    
+    def get(self, key: Tuple[str, str]) -> Optional[Tuple[dict, List[str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+
+@st.cache_resource
+def _repo_store() -> _RepoStore:
+    # Module globals are rebuilt on every rerun; a cached resource survives
+    return _RepoStore()
+
+
+def _set_repo_data(repo_data: dict) -> None:
+    """Store this session's repository data and keep only its key in session state."""
+    key = (repo_data['full_name'], repo_data['head_sha'])
+    _repo_store().put(key, repo_data)
+    st.session_state['_repo_key'] = key
+
+
+def _get_repo_data() -> Optional[Tuple[dict, List[str]]]:
+    """This session's (repository data, sorted file paths), or None if none was analyzed (or it was evicted)."""
+    key = st.session_state.get('_repo_key')
+    return _repo_store().get(key) if key else None
+
+
 def main():
     st.title("🔍 GitHub Repository Analyzer")
     st.markdown("Analyze any GitHub repository and generate architecture documentation with diagrams.")
@@ -219,8 +462,6 @@ def main():
         analyze_button = st.button("🚀 Analyze Repository", type="primary", use_container_width=True)
     
     # Session state initialization
-    if 'repo_data' not in st.session_state:
-        st.session_state.repo_data = None
     if 'analysis_results' not in st.session_state:
         st.session_state.analysis_results = None
     if 'diagrams' not in st.session_state:
@@ -234,24 +475,27 @@ def main():
             st.error("Please provide a Google API Key in the sidebar.")
             return
         
-        # Step 1: Fetch repository
+        # Step 1: Fetch repository and build the RAG index as files arrive
         with st.status("Analyzing repository...", expanded=True) as status:
-            st.write("📥 Fetching repository contents...")
+            st.write("📥 Fetching and indexing repository contents...")
             
             try:
-                repo_data = fetch_repo_contents(repo_url, github_token)
-                st.session_state.repo_data = repo_data
+                repo_data, rag = load_repository(repo_url, github_token)
+                _set_repo_data(repo_data)
                 st.write(f"✅ Found {repo_data['file_count']} files ({repo_data['skipped_count']} skipped)")
-                
+                if repo_data['failed_files']:
+                    st.warning(f"⚠️ {len(repo_data['failed_files'])} files could not be downloaded and were left out; "
+                               "analyze again to retry them")
+
                 # Display repo info
                 st.write(f"📦 **{repo_data['full_name']}**")
                 st.write(f"   {repo_data['description']}")
                 st.write(f"   Language: {repo_data['language']} | ⭐ {repo_data['stars']}")
                 
-                # Step 2: Initialize agent and build RAG index
+                # Step 2: Initialize agent with the knowledge base
                 st.write("🔨 Building knowledge base...")
                 agent = RepoAnalysisAgent(google_api_key)
-                doc_count = agent.ingest_repository(repo_data)
+                doc_count = agent.ingest_repository(repo_data, rag=rag)
                 st.write(f"✅ Indexed {doc_count} document chunks")
                 
                 # Step 3: Analyze architecture
@@ -309,7 +553,9 @@ def main():
                 return
     
     # Display results if available
-    if st.session_state.repo_data:
+    stored = _get_repo_data()
+    if stored:
+        repo_data, sorted_paths = stored
         st.divider()
         
         # Tabs for different views
@@ -342,7 +588,7 @@ def main():
                 st.download_button(
                     "⬇️ Download Documentation (Markdown)",
                     st.session_state.documentation,
-                    f"{st.session_state.repo_data['name']}_architecture.md",
+                    f"{repo_data['name']}_architecture.md",
                     "text/markdown"
                 )
             elif st.session_state.analysis_results:
@@ -352,15 +598,16 @@ def main():
                 st.info("Documentation will appear here after analysis.")
         
         with tab3:
-            st.markdown(f"### Repository Files ({st.session_state.repo_data['file_count']} files)")
+            st.markdown(f"### Repository Files ({repo_data['file_count']} files)")
             
-            # Display file tree
-            files = st.session_state.repo_data['files']
-            for file_path in sorted(files.keys()):
-                with st.expander(f"📄 {file_path}"):
-                    st.code(files[file_path]['content'][:2000], language=Path(file_path).suffix[1:] or 'text')
-                    if len(files[file_path]['content']) > 2000:
-                        st.caption("(Truncated to 2000 characters)")
+            # Only the selected file is rendered; the path list was sorted once when stored
+            files = repo_data['files']
+            file_path = st.selectbox("📄 File", sorted_paths)
+            if file_path:
+                content = files[file_path]['content']
+                st.code(content[:2000], language=files[file_path]['lang'])
+                if len(content) > 2000:
+                    st.caption("(Truncated to 2000 characters)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+"""
+Repository Cache Module
+Persists fetched blob contents, tree listings and ETag-validated API
+responses in SQLite so unchanged data is never downloaded twice
+"""
+
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+try:
+    import zstandard
+except ImportError:  # Optional: entries are stored uncompressed
+    zstandard = None
+
+DEFAULT_CACHE_PATH = Path.home() / ".repo_analyzer_cache.db"
+
+# Stay well below SQLite's host parameter limit
+_QUERY_BATCH_SIZE = 500
+
+# Every zstd frame starts with this; UTF-8 text and JSON never do
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_ZSTD_LEVEL = 3
+
+
+def _compressor() -> Optional["zstandard.ZstdCompressor"]:
+    """One compressor per write; None when zstandard is not installed."""
+    return zstandard.ZstdCompressor(level=_ZSTD_LEVEL) if zstandard is not None else None
+
+
+def _decompressor() -> Optional["zstandard.ZstdDecompressor"]:
+    """One decompressor per read; None when zstandard is not installed."""
+    return zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def _compress(data: bytes, compressor: Optional["zstandard.ZstdCompressor"]) -> bytes:
+    if compressor is None:
+        return data
+    return compressor.compress(data)
+
+
+def _decompress(data: bytes, decompressor: Optional["zstandard.ZstdDecompressor"]) -> Optional[bytes]:
+    """Undo _compress; None if the entry is compressed but zstandard is not installed."""
+    if not data.startswith(_ZSTD_MAGIC):
+        return data
+    if decompressor is None:
+        return None
+    return decompressor.decompress(data)
+
+
+class RepoCache:
+    """
+    SQLite-backed cache of blob texts (keyed by git SHA), tree listings
+    (keyed by commit) and API responses with their ETags (keyed by URL).
+    Blob texts and tree listings are zstd-compressed when zstandard is installed.
+    """
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH):
+        """
+        Open (creating if needed) the cache database.
+
+        Args:
+            path: Location of the SQLite database file
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, content BLOB, size INT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS trees ("
+                "full_name TEXT, commit_sha TEXT, entries BLOB, PRIMARY KEY (full_name, commit_sha))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, body BLOB)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def get_blobs(self, shas: List[str]) -> Dict[str, str]:
+        """
+        Look up cached blob texts.
+
+        Args:
+            shas: Blob SHAs to look up
+
+        Returns:
+            Mapping of SHA to text for every cache hit
+        """
+        found = {}
+        decompressor = _decompressor()
+        with closing(self._connect()) as conn:
+            for start in range(0, len(shas), _QUERY_BATCH_SIZE):
+                batch = shas[start:start + _QUERY_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT sha, content FROM blobs WHERE sha IN ({placeholders})", batch
+                )
+                for sha, content in rows:
+                    content = _decompress(content, decompressor)
+                    if content is not None:
+                        found[sha] = content.decode("utf-8")
+        return found
+
+    def put_blobs(self, items: Iterable[Tuple[str, str]]) -> None:
+        """
+        Store blob texts in a single transaction.
+
+        Args:
+            items: (sha, text) pairs
+        """
+        compressor = _compressor()
+
+        def rows():
+            # Encode lazily so only one encoded blob is alive at a time
+            for sha, text in items:
+                content = text.encode("utf-8")
+                yield sha, _compress(content, compressor), len(content)
+
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO blobs (sha, content, size) VALUES (?, ?, ?)", rows())
+
+    def get_tree(self, full_name: str, commit_sha: str) -> Optional[Tuple[List[Tuple[str, str, int]], int]]:
+        """Return the cached ((path, sha, size) entries, blob count) listing for a commit, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT entries FROM trees WHERE full_name = ? AND commit_sha = ?",
+                (full_name, commit_sha)
+            ).fetchone()
+        entries = _decompress(row[0], _decompressor()) if row is not None else None
+        if entries is None:
+            return None
+        listing = orjson.loads(entries)
+        return [tuple(entry) for entry in listing["entries"]], listing["blob_count"]
+
+    def put_tree(self, full_name: str, commit_sha: str,
+                 entries: List[Tuple[str, str, int]], blob_count: int) -> None:
+        """
+        Store the listing for a commit.
+
+        Args:
+            full_name: Repository as owner/name
+            commit_sha: Commit the listing was taken at
+            entries: (path, sha, size) candidate files
+            blob_count: Total blobs in the tree, including pruned ones
+        """
+        listing = {"entries": entries, "blob_count": blob_count}
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO trees (full_name, commit_sha, entries) VALUES (?, ?, ?)",
+                (full_name, commit_sha, _compress(orjson.dumps(listing), _compressor()))
+            )
+
+    def get_response(self, url: str) -> Optional[Tuple[str, Any]]:
+        """Return the (etag, JSON body) last stored for a URL, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT etag, body FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0], orjson.loads(row[1])
+
+    def put_response(self, url: str, etag: str, body: Any) -> None:
+        """
+        Store an API response so the next request can be made conditional.
+
+        Args:
+            url: Full request URL, including the query string
+            etag: ETag header of the response
+            body: Decoded JSON body
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, body) VALUES (?, ?, ?)",
+                (url, etag, orjson.dumps(body))
+            )